@@ -1,18 +1,46 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-import pikepdf
-import pdfplumber
+from fastapi.responses import ORJSONResponse
+import asyncio
+import functools
+import hashlib
 import io
 import os
-import requests
+import httpx
 import json
+import logging
+import orjson
+import re
 import time
-import gc
 import resend
-from pydantic import BaseModel, EmailStr, ValidationError
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pydantic import BaseModel, EmailStr, ValidationError, field_validator
 from dotenv import load_dotenv
 from security_utils import mask_transaction_pii, scrub_sensitive_data
 
+# The PDF stack is heavy (pikepdf links libqpdf, pdfplumber pulls in
+# pdfminer.six), so it is imported on first upload rather than at startup.
+# Workers that only serve health checks or chat never pay the import cost.
+pikepdf = None
+pdfplumber = None
+fitz = None
+
+
+def load_pdf_libraries() -> None:
+    """Import the PDF libraries on first use to keep cold starts light."""
+    global pikepdf, pdfplumber, fitz
+    if pikepdf is None:
+        import pikepdf as pikepdf_module
+        import pdfplumber as pdfplumber_module
+        import fitz as fitz_module  # PyMuPDF
+        # pdfminer logs per-object at DEBUG/INFO; on a large statement that
+        # logging alone dwarfs the parse time.
+        logging.getLogger("pdfminer").setLevel(logging.WARNING)
+        pikepdf = pikepdf_module
+        pdfplumber = pdfplumber_module
+        fitz = fitz_module
+
 # Rate limiting
 try:
     from slowapi import Limiter, _rate_limit_exceeded_handler
@@ -25,24 +53,57 @@ except ImportError:
     RATE_LIMIT_ENABLED = False
     print("Warning: slowapi not installed. Rate limiting is disabled. Install with: pip install slowapi")
 
+# Fallback limiter state: "<endpoint>:<ip>" -> (tokens, last_refill, capacity, refill_rate)
+# Capacity and rate are stored per bucket because the table is shared
+# across endpoints with different limits.
+_PERIOD_SECONDS = {"second": 1.0, "minute": 60.0, "hour": 3600.0, "day": 86400.0}
+_token_buckets = {}
+
+
 def rate_limit(limit_string: str):
-    """Conditional rate limit decorator - only applies if slowapi is installed."""
+    """Rate limit decorator - slowapi when installed, else a token bucket.
+
+    The fallback implements a continuously-refilling token bucket per
+    client IP, which smooths bursts instead of resetting at fixed window
+    boundaries. State is per-process, so with multiple workers the
+    effective limit is limit * workers - fine for abuse prevention.
+    """
     def decorator(func):
         if RATE_LIMIT_ENABLED and limiter:
             return limiter.limit(limit_string)(func)
-        return func
+
+        count, _, period = limit_string.partition("/")
+        capacity = float(count)
+        refill_rate = capacity / _PERIOD_SECONDS[period]
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            request = kwargs.get("request")
+            if request is None:
+                request = next((a for a in args if isinstance(a, Request)), None)
+            if request is not None and request.client:
+                key = f"{func.__name__}:{request.client.host}"
+                now = time.monotonic()
+                tokens, last_refill, _, _ = _token_buckets.get(key, (capacity, now, capacity, refill_rate))
+                tokens = min(capacity, tokens + (now - last_refill) * refill_rate)
+                if tokens < 1.0:
+                    raise HTTPException(status_code=429, detail="Rate limit exceeded. Please try again later.")
+                _token_buckets[key] = (tokens - 1.0, now, capacity, refill_rate)
+                if len(_token_buckets) > 4096:
+                    # Drop buckets that would be full once refilled at their
+                    # own rate; those carry no state, so nothing is lost.
+                    for stale in [k for k, (t, ts, cap, rate) in _token_buckets.items()
+                                  if t + (now - ts) * rate >= cap]:
+                        _token_buckets.pop(stale, None)
+            return await func(*args, **kwargs)
+        return wrapper
     return decorator
 
-# Sanitize helper
-def sanitize_text(text: str) -> str:
-    """Remove potentially problematic characters from text to prevent injection."""
-    if not text:
-        return ""
-    return text.replace('\r', '').replace('\n', ' ').replace('\x00', '').strip()
 
 load_dotenv(dotenv_path="../.env")
 
-app = FastAPI()
+# orjson serializes responses ~3-5x faster than stdlib json
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Add rate limiter to app state if available
 if RATE_LIMIT_ENABLED and limiter:
@@ -64,6 +125,10 @@ except Exception as e:
     print(f"Error parsing ALLOWED_ORIGINS: {e}")
     ALLOWED_ORIGINS = ["http://localhost:5173", "http://localhost:3000"]
 
+# Frozen set for O(1) membership checks on every error path; the list is
+# kept for the middleware and the first-origin fallback below.
+ALLOWED_ORIGINS_SET = frozenset(ALLOWED_ORIGINS)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
@@ -79,7 +144,7 @@ from starlette.exceptions import HTTPException as StarletteHTTPException
 def get_cors_origin(request) -> str:
     """Get appropriate CORS origin from request, validated against allowed origins."""
     origin = request.headers.get("origin", "")
-    if origin in ALLOWED_ORIGINS:
+    if origin in ALLOWED_ORIGINS_SET:
         return origin
     # Fallback to first allowed origin for non-browser requests
     return ALLOWED_ORIGINS[0] if ALLOWED_ORIGINS else ""
@@ -132,22 +197,47 @@ if RESEND_API_KEY:
 class ContactRequest(BaseModel):
     category: str
     name: str
-    email: str # Staying with str to avoid missing dependency issues, relying on sanitization
+    email: EmailStr
     description: str
 
+    @field_validator("category", "name", mode="before")
+    @classmethod
+    def _sanitize_single_line(cls, v):
+        """Remove potentially problematic characters to prevent injection."""
+        if isinstance(v, str):
+            return v.replace('\r', '').replace('\n', ' ').replace('\x00', '').strip()
+        return v
+
+    @field_validator("description", mode="before")
+    @classmethod
+    def _sanitize_multi_line(cls, v):
+        """Strip carriage returns but keep newlines for the email body."""
+        if isinstance(v, str):
+            return v.replace('\r', '')
+        return v
+
+def send_support_email(params: dict, safe_category: str, safe_name: str, safe_email: str) -> None:
+    """Send a support email via Resend. Runs as a background task."""
+    try:
+        email_response = resend.Emails.send(params)
+        print(f"Email sent successfully: {email_response}")
+    except Exception as e:
+        print(f"Failed to send email: {str(e)}")
+        # Log the contact request details for manual follow-up
+        print(f"CONTACT REQUEST (email failed): Category={safe_category}, Name={safe_name}, Email={safe_email}")
+
+
 @app.post("/contact")
 @rate_limit("5/minute")
-async def contact_support(contact_request: ContactRequest, request: Request):
+async def contact_support(contact_request: ContactRequest, request: Request, background_tasks: BackgroundTasks):
     print(f"Received contact request: {contact_request}")
 
-    # Sanitize inputs
-    safe_category = sanitize_text(contact_request.category)
-    safe_name = sanitize_text(contact_request.name)
-    safe_email = sanitize_text(contact_request.email)
-    # Description needs to allow newlines for the body, but should be careful?
-    # Actually, for the body it is fine, but we should ensure no header injection via body if that's even possible (unlikely in MIMEText).
-    # But CodeRabbit suggested removing \r.
-    safe_description = contact_request.description.replace('\r', '')
+    # Inputs are already sanitized by the ContactRequest field validators,
+    # and the email format is enforced by EmailStr.
+    safe_category = contact_request.category
+    safe_name = contact_request.name
+    safe_email = contact_request.email
+    safe_description = contact_request.description
 
     # 1. Check if Resend is configured
     if not RESEND_API_KEY or not RECIPIENT_EMAIL:
@@ -155,9 +245,9 @@ async def contact_support(contact_request: ContactRequest, request: Request):
         print(f"Would send email to {RECIPIENT_EMAIL} from {safe_email} about {safe_category}")
         return {"status": "success", "message": "Support request received (Simulation)"}
 
-    # 2. Send Email via Resend
-    try:
-        email_body = f"""<h2>New Contact Request</h2>
+    # 2. Send Email via Resend, from a background task so the response isn't
+    # blocked on the (synchronous, ~hundreds of ms) Resend API call.
+    email_body = f"""<h2>New Contact Request</h2>
 <p><strong>Category:</strong> {safe_category}</p>
 <p><strong>Name:</strong> {safe_name}</p>
 <p><strong>Email:</strong> {safe_email}</p>
@@ -166,34 +256,62 @@ async def contact_support(contact_request: ContactRequest, request: Request):
 <p>{safe_description.replace(chr(10), '<br>')}</p>
 """
 
-        params = {
-            "from": SENDER_EMAIL,
-            "to": [RECIPIENT_EMAIL],
-            "subject": f"New Support Request: {safe_category}",
-            "html": email_body,
-            "reply_to": safe_email
-        }
+    params = {
+        "from": SENDER_EMAIL,
+        "to": [RECIPIENT_EMAIL],
+        "subject": f"New Support Request: {safe_category}",
+        "html": email_body,
+        "reply_to": safe_email
+    }
 
-        email_response = resend.Emails.send(params)
-        print(f"Email sent successfully: {email_response}")
-        return {"status": "success", "message": "Support request sent successfully"}
-
-    except Exception as e:
-        print(f"Failed to send email: {str(e)}")
-        # Log the contact request details for manual follow-up
-        print(f"CONTACT REQUEST (email failed): Category={safe_category}, Name={safe_name}, Email={safe_email}")
-        # Return success to user - their request was received, even if email delivery failed
-        return {
-            "status": "success",
-            "message": "Support request received. We'll get back to you soon.",
-            "email_sent": False
-        }
+    background_tasks.add_task(send_support_email, params, safe_category, safe_name, safe_email)
+    return {"status": "success", "message": "Support request received. We'll get back to you soon."}
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 # Gemini model - Using Gemini 2.0 Flash for fast, quality responses
 GEMINI_MODEL = "gemini-2.0-flash"
 
+# Candidate models for statement extraction, raced in parallel ("hedged
+# requests"): the first valid response wins and the losers are cancelled,
+# so one slow/rate-limited model no longer stalls the whole request.
+MODELS = [GEMINI_MODEL, "gemini-2.0-flash-lite"]
+
+# Rolling per-model stats decide the race order at runtime: the model that
+# has recently been fastest and most reliable fires first, the rest start
+# slightly delayed as hedges.
+MODEL_STATS = {model: {"ewma_latency": 5.0, "success": 1.0} for model in MODELS}
+HEDGE_DELAY_SECONDS = 0.75
+
+
+def rank_models() -> list:
+    """Order candidate models by recent latency weighted by success rate."""
+    return sorted(MODELS, key=lambda m: MODEL_STATS[m]["ewma_latency"] / max(MODEL_STATS[m]["success"], 0.01))
+
+
+def record_model_result(model: str, latency: float, ok: bool) -> None:
+    """Fold one observation into the model's rolling stats."""
+    stats = MODEL_STATS[model]
+    stats["ewma_latency"] = 0.8 * stats["ewma_latency"] + 0.2 * latency
+    stats["success"] = 0.8 * stats["success"] + 0.2 * (1.0 if ok else 0.0)
+
+# Shared async client for all Gemini calls: connections are pooled and
+# kept alive, HTTP/2 multiplexes the raced model requests over one TCP
+# connection, and fully-async I/O frees the threadpool that blocking
+# requests.post used to monopolize. A tight read timeout plus the model
+# race beats one long blanket timeout: a stalled model no longer pins a
+# worker for a full minute.
+GEMINI_CLIENT = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=64, max_connections=256),
+    timeout=httpx.Timeout(30.0, connect=5.0),
+)
+
+
+@app.on_event("shutdown")
+async def close_gemini_client():
+    await GEMINI_CLIENT.aclose()
+
 # Transaction categories - must match frontend/config/constants.ts
 TRANSACTION_CATEGORIES = ['Food', 'Transport', 'Shopping', 'Utilities', 'Entertainment', 'Health', 'Travel', 'Other']
 
@@ -212,74 +330,441 @@ If the text contains no transactions, return an empty array.
 Output ONLY raw JSON. No markdown formatting.
 """
 
+# Bump when SYSTEM_PROMPT changes so stale cached extractions are not reused
+PROMPT_VERSION = "v1"
 
-def call_gemini(extracted_text: str) -> str | None:
-    """Call Gemini API for transaction extraction."""
-    if not GEMINI_API_KEY:
-        return None
+# Static pieces of the extraction payload, built once at import so each
+# request only serializes the variable contents.
+SYSTEM_INSTRUCTION_PART = {"parts": [{"text": SYSTEM_PROMPT}]}
+EXTRACTION_GENERATION_CONFIG = {
+    # Zero temperature + native JSON mode: extraction is deterministic
+    # (so identical inputs are cacheable), and JSON mode avoids markdown
+    # fences the parser would otherwise have to strip.
+    "temperature": 0.0,
+    "maxOutputTokens": 4096,
+    "responseMimeType": "application/json"
+}
+
+
+# Dedicated pool for the blocking PDF pipeline (decrypt + extract)
+PDF_POOL = ThreadPoolExecutor(max_workers=os.cpu_count())
 
-    print(f"Calling Gemini API with model: {GEMINI_MODEL}")
 
-    # Warn if text will be truncated
-    if len(extracted_text) > 30000:
-        print(f"Warning: Text truncated from {len(extracted_text)} to 30000 characters. Some transactions may be missed.")
+# Statement text pages are tens of KB; a multi-MB content stream is chart
+# or artwork, so spending pdfminer time decoding it buys no text.
+MAX_PAGE_STREAM_BYTES = 2 * 1024 * 1024
 
+# Path construction/painting, clipping, and shading operators: pure
+# graphics work that produces no text but that pdfminer still parses
+# operator by operator.
+GRAPHICS_OPERATORS = frozenset([
+    "m", "l", "c", "v", "y", "h", "re",
+    "f", "F", "f*", "B", "B*", "b", "b*", "s", "S", "n",
+    "W", "W*", "sh",
+])
+
+
+def _strip_graphics_operators(pdf_bytes: bytes, password: str) -> bytes:
+    """Best-effort removal of graphics operators before the pdfminer pass.
+
+    Vendor logos and backgrounds can fill content streams with path
+    operators that pdfminer parses one by one for zero text. Returns the
+    original bytes unchanged if filtering fails for any reason.
+    """
     try:
-        response = requests.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}",
+        with pikepdf.open(io.BytesIO(pdf_bytes), password=password) as pdf:
+            changed = False
+            for page in pdf.pages:
+                instructions = pikepdf.parse_content_stream(page)
+                filtered = [inst for inst in instructions
+                            if str(inst.operator) not in GRAPHICS_OPERATORS]
+                if len(filtered) < len(instructions):
+                    page.Contents = pdf.make_stream(pikepdf.unparse_content_stream(filtered))
+                    changed = True
+            if not changed:
+                return pdf_bytes
+            out = io.BytesIO()
+            pdf.save(out)
+            return out.getvalue()
+    except Exception as e:
+        print(f"Graphics stripping failed, using original bytes: {str(e)}")
+        return pdf_bytes
+
+
+def _page_stream_size(page) -> int:
+    """Raw (undecoded) size of a page's content streams, in bytes."""
+    from pdfminer.pdftypes import resolve1
+    contents = page.page_obj.contents or []
+    if not isinstance(contents, list):
+        contents = [contents]
+    total = 0
+    for ref in contents:
+        stream = resolve1(ref)
+        rawdata = getattr(stream, "rawdata", None)
+        if rawdata:
+            total += len(rawdata)
+    return total
+
+
+def _extract_page_range(pdf_bytes: bytes, password: str, start: int, end: int) -> str:
+    """Extract one chunk of pages with pdfplumber. Process-pool worker."""
+    import pdfplumber as pdfplumber_worker
+    with pdfplumber_worker.open(io.BytesIO(pdf_bytes), password=password) as pdf:
+        return "\n".join(
+            page.extract_text_simple() or ""
+            for page in pdf.pages[start:end]
+            if _page_stream_size(page) <= MAX_PAGE_STREAM_BYTES
+        )
+
+
+def extract_with_pdfplumber(pdf_bytes: bytes, password: str) -> str:
+    """Fallback extractor for PDFs where MuPDF returns (near-)empty text.
+
+    pdfminer is pure Python and holds the GIL, so larger documents fan
+    page ranges out across processes; tiny documents stay in-process to
+    avoid fork overhead.
+
+    extract_text_simple skips pdfplumber's word-clustering layout
+    analysis; the LLM only needs the raw text stream, not positional
+    fidelity.
+    """
+    # pikepdf re-writes the file without graphics operators first; a rare
+    # extra serialization pass on this already-slow path, paid only when a
+    # page actually contains graphics. pikepdf.save drops encryption, so
+    # the password below is simply ignored for stripped output.
+    pdf_bytes = _strip_graphics_operators(pdf_bytes, password)
+    with pdfplumber.open(io.BytesIO(pdf_bytes), password=password) as pdf:
+        num_pages = len(pdf.pages)
+        if num_pages <= 2:
+            return "\n".join(
+                page.extract_text_simple() or ""
+                for page in pdf.pages
+                if _page_stream_size(page) <= MAX_PAGE_STREAM_BYTES
+            )
+
+    workers = min(os.cpu_count() or 1, num_pages)
+    chunk_size = -(-num_pages // workers)  # ceil division
+    ranges = [(start, min(start + chunk_size, num_pages)) for start in range(0, num_pages, chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parts = list(executor.map(
+            _extract_page_range,
+            [pdf_bytes] * len(ranges),
+            [password] * len(ranges),
+            [r[0] for r in ranges],
+            [r[1] for r in ranges],
+        ))
+    return "\n".join(parts)
+
+
+# Extracted-text cache: a retry that missed the result cache (e.g. the LLM
+# call failed and the user re-POSTs) skips re-parsing the PDF pages.
+TEXT_CACHE_MAX_ENTRIES = 32
+text_cache: OrderedDict = OrderedDict()
+
+
+# Input budget for the extraction prompt, expressed in tokens rather than
+# characters. ~4 chars/token is a good average for statement text.
+MAX_INPUT_TOKENS = 8000
+CHARS_PER_TOKEN = 4
+
+# A statement PDF has a few thousand objects at most; a pathological file
+# can declare a huge xref table and force large allocations before any
+# page is read.
+MAX_PDF_OBJECTS = 100_000
+
+
+def decrypt_and_extract(file_bytes: bytes, password: str | None) -> str:
+    """Decrypt a PDF when needed and extract its text. Blocking; run in PDF_POOL.
+
+    MuPDF decrypts and parses in a single pass via authenticate(), so
+    there is no decrypt-and-rewrite round-trip or intermediate buffer.
+    pdfplumber remains the fallback for PDFs where MuPDF returns
+    (near-)empty text.
+    """
+    try:
+        doc = fitz.open(stream=file_bytes, filetype="pdf")
+    except Exception as e:
+        print(f"PDF open error: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid or corrupted PDF file.")
+
+    pdf_password = ""
+    if doc.needs_pass:
+        # Try the password plus common user-error variants; dict.fromkeys
+        # deduplicates equal candidates.
+        pwd = password or ""
+        for candidate in dict.fromkeys([pwd, pwd.strip(), pwd.strip().upper()]):
+            if doc.authenticate(candidate):
+                pdf_password = candidate
+                break
+        else:
+            doc.close()
+            if password:
+                raise HTTPException(status_code=400, detail="Incorrect Password")
+            raise HTTPException(status_code=400, detail="PDF is password protected")
+
+    if doc.xref_length() > MAX_PDF_OBJECTS:
+        doc.close()
+        raise HTTPException(status_code=400, detail="Invalid or corrupted PDF file.")
+
+    # Scanned/image PDFs carry no font resources. Checking the first few
+    # pages is nearly free and beats discovering emptiness only after a
+    # full extraction pass (the <50-char check below stays as the net for
+    # odd documents that have fonts but no extractable text).
+    if doc.page_count and not any(doc.get_page_fonts(i) for i in range(min(5, doc.page_count))):
+        doc.close()
+        raise HTTPException(status_code=400, detail="Could not extract text from PDF. It might be scanned/image-based.")
+
+    # Cache lookup happens only after authentication so a cached document
+    # can never be read back without its password.
+    digest = hashlib.md5(file_bytes).digest()
+    cached_text = text_cache.get(digest)
+    if cached_text is not None:
+        text_cache.move_to_end(digest)
+        doc.close()
+        return cached_text
+
+    # Stop once the token budget is comfortably exceeded (2x slack for the
+    # chars-per-token estimate): pages past that point would be truncated
+    # before the model ever saw them, so parsing them is wasted work.
+    parts = []
+    total_chars = 0
+    for page in doc:
+        text = page.get_text("text")
+        parts.append(text)
+        total_chars += len(text)
+        if total_chars >= MAX_INPUT_TOKENS * CHARS_PER_TOKEN * 2:
+            break
+    extracted_text = "\n".join(parts)
+    doc.close()
+
+    if len(extracted_text) < 50:
+        extracted_text = extract_with_pdfplumber(file_bytes, pdf_password)
+
+    text_cache[digest] = extracted_text
+    while len(text_cache) > TEXT_CACHE_MAX_ENTRIES:
+        text_cache.popitem(last=False)
+
+    return extracted_text
+
+
+def _truncate_at_line_boundary(text: str, limit: int) -> str:
+    """Cut at the last complete line before limit, so a transaction row is
+    never sliced in half and sent to the model as garbage."""
+    cutoff = text.rfind('\n', 0, limit)
+    if cutoff < 0:
+        cutoff = limit
+    return text[:cutoff]
+
+
+def truncate_to_token_budget(text: str, max_tokens: int = MAX_INPUT_TOKENS) -> str:
+    """Truncate text to a token budget via the chars-per-token estimate.
+
+    Returns the original string untouched when it already fits, so the
+    common case allocates nothing. When truncation happens, the cut is
+    snapped back to the last complete line.
+    """
+    limit = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    print(f"Warning: Text truncated from {len(text)} chars to ~{max_tokens} tokens. Some transactions may be missed.")
+    return _truncate_at_line_boundary(text, limit)
+
+
+async def _generate_with_model(model: str, contents: list) -> str | None:
+    """Stream a generateContent request for one model, returning its text or None.
+
+    The response is streamed over SSE and the connection is closed as soon
+    as the JSON array balances, instead of waiting for the model's stop
+    token — the tail generation time is saved on every request.
+    """
+    started = time.time()
+    content = None
+    try:
+        async with GEMINI_CLIENT.stream(
+            "POST",
+            f"https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent?alt=sse&key={GEMINI_API_KEY}",
             headers={
                 "Content-Type": "application/json",
             },
-            json={
-                "contents": [
-                    {
-                        "parts": [
-                            {"text": f"{SYSTEM_PROMPT}\n\nHere is the bank statement text:\n\n{extracted_text[:30000]}"}
-                        ]
-                    }
-                ],
-                "generationConfig": {
-                    "temperature": 0.7,
-                    "maxOutputTokens": 4096
-                }
-            },
-            timeout=60
-        )
+            # orjson.dumps to bytes skips httpx's stdlib-json encode
+            content=orjson.dumps({
+                # The byte-identical system prompt goes in system_instruction,
+                # separate from the per-request text, so the provider's prompt
+                # cache can reuse its KV prefix across requests.
+                "system_instruction": SYSTEM_INSTRUCTION_PART,
+                "contents": contents,
+                "generationConfig": EXTRACTION_GENERATION_CONFIG,
+            }),
+        ) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                print(f"Gemini Error {response.status_code} ({model}): {body.decode(errors='replace')}")
+            else:
+                chunks = []
+                depth = 0
+                array_started = False
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if not data or data == "[DONE]":
+                        continue
+                    try:
+                        event = orjson.loads(data)
+                    except orjson.JSONDecodeError:
+                        continue
 
-        if response.status_code == 200:
-            ai_data = response.json()
-            try:
-                return ai_data['candidates'][0]['content']['parts'][0]['text']
-            except (KeyError, IndexError, TypeError) as e:
-                print(f"Gemini response parsing error: {str(e)}")
-                print(f"Response structure: {ai_data}")
-                return None
-        else:
-            print(f"Gemini Error {response.status_code}: {response.text}")
-            return None
+                    cached_tokens = event.get('usageMetadata', {}).get('cachedContentTokenCount')
+                    if cached_tokens:
+                        print(f"Gemini prompt cache hit ({model}): {cached_tokens} cached tokens")
+
+                    try:
+                        part = event['candidates'][0]['content']['parts'][0]['text']
+                    except (KeyError, IndexError, TypeError):
+                        continue
+                    chunks.append(part)
+
+                    # Track bracket balance; brackets inside strings can fool
+                    # it, so completion is confirmed with a real parse before
+                    # hanging up.
+                    for char in part:
+                        if char == '[':
+                            depth += 1
+                            array_started = True
+                        elif char == ']':
+                            depth -= 1
+                    if array_started and depth <= 0:
+                        candidate = "".join(chunks)
+                        try:
+                            parse_json_response(candidate)
+                        except json.JSONDecodeError:
+                            continue
+                        break
+
+                content = "".join(chunks) or None
 
     except Exception as e:
-        print(f"Gemini Exception: {str(e)}")
+        print(f"Gemini Exception ({model}): {str(e)}")
+        content = None
+
+    record_model_result(model, time.time() - started, bool(content))
+    return content
+
+
+async def call_gemini(extracted_text: str) -> str | None:
+    """Call Gemini API for transaction extraction, racing the candidate models."""
+    if not GEMINI_API_KEY:
         return None
 
+    ranked = rank_models()
+    print(f"Calling Gemini API, racing models: {ranked}")
 
-def parse_json_response(content: str) -> list:
-    """Extract and parse JSON from AI response."""
-    # Extract JSON
-    if "```json" in content:
-        json_str = content.split("```json")[1].split("```")[0].strip()
-    elif "```" in content:
-        json_str = content.split("```")[1].split("```")[0].strip()
-    else:
-        json_str = content
+    prompt = "Here is the bank statement text:\n\n" + truncate_to_token_budget(extracted_text)
 
-    # Clean potential non-json headers
-    if "[" in json_str:
-        json_str = "[" + json_str.split("[", 1)[1]
-    if "]" in json_str:
-        json_str = json_str.rsplit("]", 1)[0] + "]"
+    contents = [{"role": "user", "parts": [{"text": prompt}]}]
 
-    return json.loads(json_str)
+    async def hedged_generate(model: str, delay: float) -> str | None:
+        if delay:
+            await asyncio.sleep(delay)
+        return await _generate_with_model(model, contents)
+
+    pending = {
+        asyncio.create_task(hedged_generate(model, rank * HEDGE_DELAY_SECONDS))
+        for rank, model in enumerate(ranked)
+    }
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                content = task.result()
+                if content:
+                    return content
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def call_gemini_with_feedback(extracted_text: str, prior_content: str, error: str) -> str | None:
+    """Re-call Gemini once with the parse error fed back as a correction turn.
+
+    A malformed response used to cost the user a full re-upload; feeding
+    the error back recovers most failures for one extra model call and no
+    PDF re-parse.
+    """
+    if not GEMINI_API_KEY:
+        return None
+
+    model = rank_models()[0]
+    print(f"Retrying Gemini with parse feedback on model: {model}")
+
+    prompt = "Here is the bank statement text:\n\n" + truncate_to_token_budget(extracted_text)
+    contents = [
+        {"role": "user", "parts": [{"text": prompt}]},
+        {"role": "model", "parts": [{"text": prior_content}]},
+        {"role": "user", "parts": [{"text": f"Your output could not be parsed as JSON ({error}). Output ONLY the corrected raw JSON array."}]},
+    ]
+    return await _generate_with_model(model, contents)
+
+
+# In-process analysis cache: the Gemini call dominates latency, so re-uploads
+# of the same statement are answered from cache instead of re-parsing and
+# re-calling the model. Keyed on SHA-256 of the raw file bytes.
+ANALYSIS_CACHE_TTL = 24 * 60 * 60  # 24h
+ANALYSIS_CACHE_MAX_ENTRIES = 128
+analysis_cache: OrderedDict = OrderedDict()
+
+# Single-flight table: cache key -> Future for an analysis currently in
+# progress, so concurrent uploads of the same file share one parse + LLM
+# call instead of racing past the cache miss independently.
+_inflight_analyses: dict = {}
+
+
+def canonical_cache_text(text: str) -> str:
+    """Collapse whitespace so trivially re-flowed statements share a cache key.
+
+    Two exports of the same statement often differ only in line breaks and
+    spacing; canonicalizing before hashing lets them hit the same entry.
+    """
+    return " ".join(text.split())
+
+
+def cache_get(key: str):
+    """Return a cached result if present and not expired, else None."""
+    entry = analysis_cache.get(key)
+    if not entry:
+        return None
+    cached_at, result = entry
+    if time.time() - cached_at > ANALYSIS_CACHE_TTL:
+        del analysis_cache[key]
+        return None
+    analysis_cache.move_to_end(key)
+    return result
+
+
+def cache_set(key: str, result) -> None:
+    """Store a result, evicting the oldest entry when the cache is full."""
+    analysis_cache[key] = (time.time(), result)
+    analysis_cache.move_to_end(key)
+    while len(analysis_cache) > ANALYSIS_CACHE_MAX_ENTRIES:
+        analysis_cache.popitem(last=False)
+
+
+# Locates the JSON array inside an AI response without string splitting
+JSON_ARRAY_RE = re.compile(r'\[.*\]', re.DOTALL)
+JSON_DECODER = json.JSONDecoder()
+
+
+def parse_json_response(content: str) -> list:
+    """Extract and parse JSON from AI response.
+
+    raw_decode parses in place from the first '[' so markdown fences and
+    surrounding prose are skipped without allocating intermediate strings.
+    """
+    match = JSON_ARRAY_RE.search(content)
+    if not match:
+        return []
+    return JSON_DECODER.raw_decode(content, match.start())[0]
 
 
 @app.post("/analyze")
@@ -293,6 +778,7 @@ async def analyze_statement(
         raise HTTPException(status_code=500, detail="Missing GEMINI_API_KEY. Please set it in your .env file.")
 
     try:
+        load_pdf_libraries()
         start_time = time.time()
 
         # 0. Validate File Size (Max 10MB) - Prevent DoS
@@ -300,94 +786,135 @@ async def analyze_statement(
         if file.size and file.size > MAX_FILE_SIZE:
              raise HTTPException(status_code=413, detail="File too large. Maximum size is 10MB.")
 
-        # 1. Read file into RAM
-        file_bytes = await file.read()
-        file_stream = io.BytesIO(file_bytes)
-        decrypted_stream = io.BytesIO()
+        # 1. Read file into RAM in bounded chunks, aborting mid-stream once
+        # the cap is exceeded — the declared size above is client-controlled
+        # and can't be trusted on its own.
+        CHUNK_SIZE = 1 << 20  # 1MB
+        buffer = bytearray()
+        while True:
+            chunk = await file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            buffer.extend(chunk)
+            if len(buffer) > MAX_FILE_SIZE:
+                raise HTTPException(status_code=413, detail="File too large. Maximum size is 10MB.")
+        file_bytes = bytes(buffer)
+
+        # A file claiming to be a PDF but missing the magic bytes is
+        # rejected before any parsing work; genuinely non-PDF uploads
+        # (e.g. text statements) still take the plain-text path below.
+        if (b"%PDF-" not in file_bytes[:1024]
+                and (file.content_type == "application/pdf"
+                     or (file.filename or "").lower().endswith(".pdf"))):
+            raise HTTPException(status_code=400, detail="Not a valid PDF file.")
+
+        # Content-addressed cache hit: skip parsing and the LLM entirely.
+        # The supplied password is part of the key so a cached result for
+        # an encrypted document is never served without its credential.
+        cache_key = hashlib.sha256(file_bytes + b"|" + (password or "").encode()).hexdigest()
+        cached_result = cache_get(cache_key)
+        if cached_result is not None:
+            print("Analysis cache hit, returning cached transactions")
+            return cached_result
+
+        # Single-flight: if an identical upload is already being analyzed,
+        # wait for its result instead of parsing and calling the LLM again.
+        inflight = _inflight_analyses.get(cache_key)
+        if inflight is not None:
+            print("Coalescing duplicate upload onto in-flight analysis")
+            return await asyncio.shield(inflight)
+        result_future = asyncio.get_running_loop().create_future()
+        _inflight_analyses[cache_key] = result_future
+        try:
+            return await _run_analysis(cache_key, file_bytes, password, result_future, start_time)
+        finally:
+            _inflight_analyses.pop(cache_key, None)
+
+    except pikepdf.PdfError as e:
+        print(f"PDF Error: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid or corrupted PDF file.")
+    except json.JSONDecodeError as e:
+        print(f"JSON Parse Error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to process the document. Please try again.")
+    except HTTPException:
+        # Let HTTPExceptions pass through (e.g., password errors, file size)
+        raise
+    except Exception as e:
+        print(f"Server Error: {str(e)}")
+        raise HTTPException(status_code=500, detail="An unexpected error occurred. Please try again.")
+
 
+async def _run_analysis(cache_key: str, file_bytes: bytes, password: str | None,
+                        result_future: asyncio.Future, start_time: float):
+    """Parse, scrub, and analyze one upload, resolving result_future for
+    any coalesced waiters."""
+    try:
         # 2. Decryption & Text Extraction
-        is_pdf = file.filename.lower().endswith('.pdf') or file.content_type == 'application/pdf'
+        # Sniff the PDF magic bytes instead of trusting the client-supplied
+        # filename/content-type; the header may sit after a short preamble.
+        is_pdf = b"%PDF-" in file_bytes[:1024]
         extracted_text = ""
 
         if is_pdf:
-            try:
-                pwd = password or ""
-                pdf = pikepdf.open(file_stream, password=pwd)
-                pdf.save(decrypted_stream)
-                pdf.close()
-            except pikepdf.PasswordError:
-                if password:
-                    trimmed = password.strip()
-                    try:
-                        file_stream.seek(0)
-                        pdf = pikepdf.open(file_stream, password=trimmed)
-                        pdf.save(decrypted_stream)
-                        pdf.close()
-                    except pikepdf.PasswordError:
-                        upper = trimmed.upper()
-                        try:
-                            file_stream.seek(0)
-                            pdf = pikepdf.open(file_stream, password=upper)
-                            pdf.save(decrypted_stream)
-                            pdf.close()
-                        except pikepdf.PasswordError:
-                            raise HTTPException(status_code=400, detail="Incorrect Password")
-                else:
-                    raise HTTPException(status_code=400, detail="PDF is password protected")
-
-            decrypted_stream.seek(0)
-            with pdfplumber.open(decrypted_stream) as pdf:
-                for page in pdf.pages:
-                    text = page.extract_text()
-                    if text:
-                        extracted_text += text + "\n"
+            # Decryption and parsing are CPU-bound C work; the whole pipeline
+            # runs in the dedicated pool so the event loop stays free to serve
+            # other requests. pikepdf/MuPDF release the GIL, so threads scale.
+            loop = asyncio.get_running_loop()
+            extracted_text = await loop.run_in_executor(PDF_POOL, decrypt_and_extract, file_bytes, password)
 
             if len(extracted_text) < 50:
                 raise HTTPException(status_code=400, detail="Could not extract text from PDF. It might be scanned/image-based.")
 
         else:
-            extracted_text = file_bytes.decode('utf-8', errors='ignore')
+            # 'replace' keeps malformed byte positions visible instead of
+            # silently dropping them like 'ignore' does
+            extracted_text = file_bytes.decode('utf-8', errors='replace')
+
+        # 3. Pre-Process & Scrub PII (truncate first so the regex pass never
+        # touches bytes the model won't see)
+        scrubbed_text = scrub_sensitive_data(truncate_to_token_budget(extracted_text))
 
-        # 3. Pre-Process & Scrub PII
-        scrubbed_text = scrub_sensitive_data(extracted_text)
+        # 4. Call Gemini API (second-level cache: the same statement text can
+        # arrive in byte-different files, e.g. re-exported PDFs)
+        llm_key = hashlib.sha256(f"{GEMINI_MODEL}|{PROMPT_VERSION}|".encode() + canonical_cache_text(scrubbed_text).encode()).hexdigest()
+        transactions = cache_get(llm_key)
 
-        # 4. Call Gemini API
-        content = call_gemini(scrubbed_text)
+        if transactions is None:
+            content = await call_gemini(scrubbed_text)
 
-        if not content:
-            raise HTTPException(status_code=500, detail="Gemini API failed. Please check your API key and try again.")
+            if not content:
+                raise HTTPException(status_code=500, detail="Gemini API failed. Please check your API key and try again.")
 
-        # 4. Parse JSON and apply PII masking
-        transactions = parse_json_response(content)
+            try:
+                transactions = parse_json_response(content)
+            except json.JSONDecodeError as e:
+                # One retry with the error fed back beats 500-ing and making
+                # the user re-upload (and re-parse) the whole statement.
+                print(f"JSON Parse Error, retrying with feedback: {str(e)}")
+                content = await call_gemini_with_feedback(scrubbed_text, content, str(e))
+                if not content:
+                    raise HTTPException(status_code=500, detail="Gemini API failed. Please check your API key and try again.")
+                transactions = parse_json_response(content)
+
+            cache_set(llm_key, transactions)
+
+        # 5. Apply PII masking
         masked_transactions = mask_transaction_pii(transactions)
+        cache_set(cache_key, masked_transactions)
 
         parse_duration = time.time() - start_time
         print(f"PDF parsing completed in {parse_duration:.2f}s")
 
+        result_future.set_result(masked_transactions)
         return masked_transactions
 
-    except pikepdf.PdfError as e:
-        print(f"PDF Error: {str(e)}")
-        raise HTTPException(status_code=400, detail="Invalid or corrupted PDF file.")
-    except json.JSONDecodeError as e:
-        print(f"JSON Parse Error: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to process the document. Please try again.")
-    except HTTPException:
-        # Let HTTPExceptions pass through (e.g., password errors, file size)
+    except BaseException as exc:
+        # Wake coalesced waiters with the same failure; mark the exception
+        # retrieved so a waiter-less future doesn't warn at GC.
+        if not result_future.done():
+            result_future.set_exception(exc)
+            result_future.exception()
         raise
-    except Exception as e:
-        print(f"Server Error: {str(e)}")
-        raise HTTPException(status_code=500, detail="An unexpected error occurred. Please try again.")
-    finally:
-        if 'file_bytes' in dir():
-            del file_bytes
-        if 'file_stream' in dir():
-            del file_stream
-        if 'decrypted_stream' in dir():
-            del decrypted_stream
-        if 'extracted_text' in dir():
-            del extracted_text
-        gc.collect()
 
 
 # ============ Chat API (Gemini Proxy) ============
@@ -411,6 +938,11 @@ class ChatRequest(BaseModel):
     conversationHistory: list = []
 
 
+# Role labels resolved once instead of a ternary per history item
+CHAT_ROLE_PREFIX = {"user": "User: "}
+CHAT_DEFAULT_PREFIX = "Assistant: "
+
+
 @app.post("/api/chat")
 @rate_limit("30/minute")
 async def chat_endpoint(chat_request: ChatRequest, request: Request):
@@ -429,36 +961,37 @@ async def chat_endpoint(chat_request: ChatRequest, request: Request):
         raise HTTPException(status_code=400, detail="Message too long. Maximum 2000 characters.")
 
     try:
-        # Build conversation context
-        history_text = "\n\n".join([
-            f"{'User' if m.get('role') == 'user' else 'Assistant'}: {m.get('content', '')}"
-            for m in chat_request.conversationHistory[-10:]
-        ])
-
-        prompt = f"""{CHAT_SYSTEM_INSTRUCTION}
-
-Here is the user's transaction data for context:
-{chat_request.transactionContext}
-
-Previous conversation:
-{history_text}
-
-User's current question: {chat_request.message}
-
-Please respond helpfully based on the transaction data above."""
-
-        response = requests.post(
+        # Build the whole prompt with one join instead of materializing the
+        # joined history and then embedding it into a second large f-string.
+        # The static instructions travel in system_instruction below, so the
+        # provider's prompt cache can reuse their KV prefix across users.
+        parts = [
+            "Here is the user's transaction data for context:\n",
+            chat_request.transactionContext,
+            "\n\nPrevious conversation:\n",
+        ]
+        for m in chat_request.conversationHistory[-10:]:
+            parts.append(CHAT_ROLE_PREFIX.get(m.get('role'), CHAT_DEFAULT_PREFIX))
+            parts.append(m.get('content', ''))
+            parts.append("\n\n")
+        parts.append("User's current question: ")
+        parts.append(chat_request.message)
+        parts.append("\n\nPlease respond helpfully based on the transaction data above.")
+        prompt = "".join(parts)
+
+        response = await GEMINI_CLIENT.post(
             f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}",
             headers={"Content-Type": "application/json"},
-            json={
+            content=orjson.dumps({
+                "system_instruction": {"parts": [{"text": CHAT_SYSTEM_INSTRUCTION}]},
                 "contents": [{"parts": [{"text": prompt}]}],
                 "generationConfig": {"temperature": 0.7, "maxOutputTokens": 1024}
-            },
+            }),
             timeout=60
         )
 
         if response.status_code == 200:
-            ai_data = response.json()
+            ai_data = orjson.loads(response.content)
             try:
                 return {"response": ai_data['candidates'][0]['content']['parts'][0]['text']}
             except (KeyError, IndexError, TypeError) as e:
@@ -523,20 +1056,23 @@ Recent Large Transactions:
 {chr(10).join([f"- {t.get('date')}: {t.get('merchant')} ({t.get('amount')}) [{t.get('category')}]" for t in top_tx[:5]])}
 """
 
-        prompt = f"{INSIGHTS_SYSTEM_INSTRUCTION}\n\nAnalyze these spending metrics:\n{prompt_data}"
+        # Static instructions go in system_instruction so the provider's
+        # prompt cache can reuse them; only the metrics vary per request.
+        prompt = f"Analyze these spending metrics:\n{prompt_data}"
 
-        response = requests.post(
+        response = await GEMINI_CLIENT.post(
             f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}",
             headers={"Content-Type": "application/json"},
-            json={
+            content=orjson.dumps({
+                "system_instruction": {"parts": [{"text": INSIGHTS_SYSTEM_INSTRUCTION}]},
                 "contents": [{"parts": [{"text": prompt}]}],
                 "generationConfig": {"temperature": 0.7, "maxOutputTokens": 512}
-            },
+            }),
             timeout=60
         )
 
         if response.status_code == 200:
-            ai_data = response.json()
+            ai_data = orjson.loads(response.content)
             try:
                 return {"insights": ai_data['candidates'][0]['content']['parts'][0]['text']}
             except (KeyError, IndexError, TypeError) as e:
@@ -3,8 +3,149 @@ Security utilities for the Credit Card Analyzer.
 Provides PII redaction and data sanitization functions.
 """
 
+import functools
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator
+
+# ---------------------------------------------------------------------------
+# Precompiled patterns. Compiled once at import so per-request scrubbing
+# never pays regex compilation/lookup cost. Everything matched here is
+# ASCII (digits, emails, Latin statement text), so re.ASCII keeps \d, \b
+# and \s as small byte classes instead of Unicode property lookups.
+# ---------------------------------------------------------------------------
+
+# Card / account numbers (used by mask_account_numbers), one alternation
+# so the text is traversed once: 16-digit card numbers with optional
+# separators, else continuous 12-16 digit account numbers.
+CARD_MASK_PATTERN = re.compile(
+    r'\b\d{4}[-\s]?\d{4}[-\s]?\d{4}[-\s]?(?P<last4_sep>\d{4})\b'
+    r'|\b\d{8,12}(?P<last4_cont>\d{4})\b',
+    re.ASCII
+)
+# Mask prefixes; only the last four digits vary, so the replacement is a
+# callback concatenating onto these instead of a backref template the
+# engine re-interprets per match
+MASK16_PREFIX = 'XXXX-XXXX-XXXX-'
+MASK_CONT_PREFIX = 'XXXX-XXXX-'
+
+
+def _card_mask_replacer(match):
+    last4 = match.group('last4_sep')
+    if last4 is not None:
+        return MASK16_PREFIX + last4
+    return MASK_CONT_PREFIX + match.group('last4_cont')
+
+# Date: simple roughly DD/MM/YYYY or DD-MM-YYYY or YYYY-MM-DD
+DATE_PATTERN = re.compile(r'\b(?:\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|\d{4}[/-]\d{1,2}[/-]\d{1,2})\b', re.ASCII)
+# Amount: number with decimal or commas, maybe Dr/Cr suffix
+# We look for something that definitely looks like currency: 1,234.00 or 1234.00
+AMOUNT_PATTERN = re.compile(r'\b[\d,]+\.\d{2}\b', re.ASCII)
+
+EMAIL_PATTERN = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', re.ASCII)
+LONG_NUMBER_PATTERN = re.compile(r'\b(?:\d[ -]*){13,19}\b', re.ASCII)
+PIN_PATTERN = re.compile(r'\b\d{6}\b', re.ASCII)
+PHONE_PATTERN = re.compile(r'\b[6-9]\d{9}\b', re.ASCII)
+# Deletion table stripping the separators the long-number pattern allows;
+# str.translate stays in C, unlike a \D regex sub per match
+SEPARATOR_TABLE = str.maketrans('', '', ' -')
+
+# Explicit PII Header Patterns (e.g., "Name : VALUE", "Address : VALUE")
+NAME_HEADER_PATTERN = re.compile(r'(?:^|\s)Name\s*:\s*([A-Z][A-Za-z\s]+)', re.IGNORECASE | re.ASCII)
+# Also catch "Name SHOAIB..." without colon (common in statement headers)
+NAME_NO_COLON_PATTERN = re.compile(r'\bName\s+([A-Z][A-Z\s]{3,})', re.IGNORECASE | re.ASCII)
+ADDRESS_HEADER_PATTERN = re.compile(r'(?:^|\s)Address\s*:\s*(.+)', re.IGNORECASE | re.ASCII)
+
+# Address keywords (common in Indian statements as per user sample)
+ADDRESS_KEYWORDS = ['ROAD', 'NAGAR', 'MARG', 'COLONY', 'SECTOR', 'PLOT', 'FLAT', 'NEAR', 'OPP', 'BEHIND', 'LANE', 'STREET', 'PO', 'DIST', 'COTTAGE', 'RANGPUR', 'KOTHI', 'RAJ']
+ADDR_KEYWORD_PATTERN = re.compile('|'.join(r'\b' + re.escape(kw) + r'\b' for kw in ADDRESS_KEYWORDS), re.IGNORECASE | re.ASCII)
+
+SAFE_HEADERS = ['STATEMENT', 'SUMMARY', 'PAYMENT', 'DATE', 'DETAILS', 'MERCHANT', 'CATEGORY', 'AMOUNT', 'CREDIT', 'DEBIT', 'BALANCE', 'TOTAL', 'DUE', 'TRANSACTIONS', 'DOMESTIC', 'BASE', 'NEUCOINS', 'LIMIT', 'ACCOUNT', 'OPENING', 'PURCHASE', 'FINANCE', 'CHARGES', 'MINIMUM', 'OVERLIMIT', 'BANK', 'CARD', 'GSTIN', 'HSN', 'CODE', 'PAGE', 'EMAIL', 'INFO']
+
+# Combined alternations so each line is walked once per stage instead of
+# once per pattern. Built from the individual patterns above so the
+# pieces stay readable; dispatch happens in the replacer callbacks.
+GLOBAL_SCRUB_PATTERN = re.compile(
+    f'(?P<email>{EMAIL_PATTERN.pattern})|(?P<number>{LONG_NUMBER_PATTERN.pattern})',
+    re.ASCII
+)
+NON_TX_SCRUB_PATTERN = re.compile(
+    f'(?P<pin>{PIN_PATTERN.pattern})'
+    f'|(?P<phone>{PHONE_PATTERN.pattern})'
+    f'|(?P<name_h>{NAME_HEADER_PATTERN.pattern})'
+    f'|(?P<name_nc>{NAME_NO_COLON_PATTERN.pattern})'
+    f'|(?P<addr_h>{ADDRESS_HEADER_PATTERN.pattern})',
+    re.IGNORECASE | re.ASCII
+)
+
+
+def _has_date_prefix(val: str) -> bool:
+    """True if val opens with a hyphenated date (DD-MM-YYYY or
+    YYYY-MM-DD, short years included), checked by offset arithmetic
+    rather than the regex engine. val only ever contains digits, spaces,
+    and hyphens, so each field is just a digit run length check.
+    """
+    n = len(val)
+    i = 0
+    while i < n and val[i].isdigit():
+        i += 1
+    first = i
+    if first not in (1, 2, 4) or i >= n or val[i] != '-':
+        return False
+    i += 1
+    j = i
+    while j < n and val[j].isdigit():
+        j += 1
+    if not 1 <= j - i <= 2 or j >= n or val[j] != '-':
+        return False
+    j += 1
+    k = j
+    while k < n and val[k].isdigit():
+        k += 1
+    # Day/month first takes a 2-4 digit year; year first takes a 1-2
+    # digit day. The run-length bound doubles as the word boundary.
+    if first == 4:
+        return 1 <= k - j <= 2
+    return 2 <= k - j <= 4
+
+
+def _number_replacer(match):
+    val = match.group(0)
+    # The long-number pattern spans hyphenated dates plus whatever
+    # digits follow them, so a statement row like
+    # "15-01-2024 16-01-2024" matches as one run. Preserve those, as
+    # redacting here would strip dates before the transaction test
+    # (date + amount) ever sees the line.
+    if _has_date_prefix(val):
+        return val
+    # The matched run only ever contains digits, spaces, and hyphens
+    digits = val.translate(SEPARATOR_TABLE)
+    if len(digits) >= 12:
+        return f"[REDACTED_NUM_{digits[-4:]}]"
+    return val
+
+
+def _global_replacer(match):
+    """Dispatch for GLOBAL_SCRUB_PATTERN: email or long number."""
+    if match.group('email') is not None:
+        return '[REDACTED_EMAIL]'
+    return _number_replacer(match)
+
+
+def _non_tx_replacer(match):
+    """Dispatch for NON_TX_SCRUB_PATTERN on non-transaction lines.
+
+    Group membership is checked explicitly rather than via lastgroup,
+    because the header patterns contain unnamed inner groups.
+    """
+    if match.group('pin') is not None:
+        return '[REDACTED_PIN]'
+    if match.group('phone') is not None:
+        return '[REDACTED_PHONE]'
+    if match.group('name_h') is not None:
+        return ' Name : [REDACTED_NAME]'
+    if match.group('name_nc') is not None:
+        return 'Name [REDACTED_NAME]'
+    return ' Address : [REDACTED_ADDRESS]'
 
 
 def mask_account_numbers(text: str) -> str:
@@ -17,15 +158,12 @@ def mask_account_numbers(text: str) -> str:
 
     Example: "4111-1111-1111-1234" -> "XXXX-XXXX-XXXX-1234"
     """
-    # Pattern for 16-digit card numbers with separators
-    pattern_with_sep = r'\b(\d{4}[-\s]?\d{4}[-\s]?\d{4}[-\s]?)(\d{4})\b'
-    text = re.sub(pattern_with_sep, r'XXXX-XXXX-XXXX-\2', text)
-
-    # Pattern for continuous 12-16 digit numbers
-    pattern_continuous = r'\b(\d{8,12})(\d{4})\b'
-    text = re.sub(pattern_continuous, r'XXXX-XXXX-\2', text)
-
-    return text
+    # Both patterns need at least 12 digits to match; most merchant
+    # strings have none, so a length check and a single counting pass
+    # skip both regexes.
+    if len(text) < 12 or sum(c.isdigit() for c in text) < 12:
+        return text
+    return CARD_MASK_PATTERN.sub(_card_mask_replacer, text)
 
 
 def scrub_sensitive_data(text: str) -> str:
@@ -37,124 +175,117 @@ def scrub_sensitive_data(text: str) -> str:
     """
     if not text:
         return ""
+    return '\n'.join(scrub_sensitive_data_iter(text.split('\n')))
 
-    # Helper patterns
-    # Date: simple roughly DD/MM/YYYY or DD-MM-YYYY or YYYY-MM-DD
-    date_pattern = re.compile(r'\b(?:\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|\d{4}[/-]\d{1,2}[/-]\d{1,2})\b')
-    # Amount: number with decimal or commas, maybe Dr/Cr suffix
-    # We look for something that definitely looks like currency: 1,234.00 or 1234.00
-    amount_pattern = re.compile(r'\b[\d,]+\.\d{2}\b')
-
-    # Address keywords (common in Indian statements as per user sample)
-    address_keywords = ['ROAD', 'NAGAR', 'MARG', 'COLONY', 'SECTOR', 'PLOT', 'FLAT', 'NEAR', 'OPP', 'BEHIND', 'LANE', 'STREET', 'PO', 'DIST', 'COTTAGE', 'RANGPUR', 'KOTHI', 'RAJ']
-
-    # Explicit PII Header Patterns (e.g., "Name : VALUE", "Address : VALUE")
-    name_header_pattern = re.compile(r'(?:^|\s)Name\s*:\s*([A-Z][A-Za-z\s]+)', re.IGNORECASE)
-    # Also catch "Name SHOAIB..." without colon (common in statement headers)
-    name_no_colon_pattern = re.compile(r'\bName\s+([A-Z][A-Z\s]{3,})', re.IGNORECASE)
-    address_header_pattern = re.compile(r'(?:^|\s)Address\s*:\s*(.+)', re.IGNORECASE)
-
-
-    lines = text.split('\n')
-    cleaned_lines = []
-
-    # Precompile address keyword pattern
-    if not hasattr(scrub_sensitive_data, 'addr_keyword_pattern'):
-        pattern_str = '|'.join(r'\b' + re.escape(kw) + r'\b' for kw in address_keywords)
-        scrub_sensitive_data.addr_keyword_pattern = re.compile(pattern_str, re.IGNORECASE)
-
-    # Define number_replacer once outside the loop (performance optimization)
-    def number_replacer(match):
-        val = match.group(0)
-        # Use the same date_pattern to check if this looks like a date
-        if date_pattern.match(val):
-            return val
-        digits = re.sub(r'\D', '', val)
-        if len(digits) >= 12:
-            return f"[REDACTED_NUM_{digits[-4:]}]"
-        return val
-
-    for i, line in enumerate(lines):
-        # 1. Global Redactions (always apply)
-        # Email
-        line = re.sub(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', '[REDACTED_EMAIL]', line)
-
-        line = re.sub(r'\b(?:\d[ -]*){13,19}\b', number_replacer, line)
 
-        # 2. Check if Transaction Line
-        # A line is a transaction if it has a DATE and an AMOUNT
-        has_date = bool(date_pattern.search(line))
-        has_amount = bool(amount_pattern.search(line))
+def scrub_sensitive_data_iter(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Streaming counterpart of scrub_sensitive_data: scrubs any iterable of
+    lines and yields them one at a time, so callers that already hold the
+    text as lines never materialize a second full copy.
+    """
+    for line in lines:
+        yield _scrub_line(line)
 
-        if has_date and has_amount:
-            # IT IS A TRANSACTION. Preserve it (after the basic masking above).
-            cleaned_lines.append(line)
-            continue
 
-        # 3. Non-Transaction Line: Aggressive Scrubbing (GLOBALLY, no line limit)
+@functools.lru_cache(maxsize=4096)
+def _scrub_line(line: str) -> str:
+    """Scrub one line. Memoized: page headers, footers, and column labels
+    repeat on every page of a statement, so identical lines are scrubbed
+    once and answered from the cache afterwards."""
+    # 1. Global Redactions: emails and long numbers in one pass over the
+    # line, gated by cheap literal checks — the pattern can only match if
+    # the line has an '@' or at least 13 digits, and most lines have
+    # neither.
+    if '@' in line or sum(c.isdigit() for c in line) >= 13:
+        line = GLOBAL_SCRUB_PATTERN.sub(_global_replacer, line)
 
-        # PIN Codes (6 digits)
-        line = re.sub(r'\b\d{6}\b', '[REDACTED_PIN]', line)
+    # 2. Check if Transaction Line
+    # A line is a transaction if it has a DATE and an AMOUNT
+    has_date = bool(DATE_PATTERN.search(line))
+    has_amount = bool(AMOUNT_PATTERN.search(line))
 
-        # Phone Numbers (10 digits starting with 6-9)
-        line = re.sub(r'\b[6-9]\d{9}\b', '[REDACTED_PHONE]', line)
+    if has_date and has_amount:
+        # IT IS A TRANSACTION. Preserve it (after the basic masking above).
+        return line
 
-        # --- Explicit Header Patterns ---
-        # Redact "Name : <value>"
-        line = name_header_pattern.sub(r' Name : [REDACTED_NAME]', line)
-        # Redact "Name SHOAIB..." (without colon)
-        line = name_no_colon_pattern.sub(r'Name [REDACTED_NAME]', line)
-        # Redact "Address : <value>"
-        line = address_header_pattern.sub(r' Address : [REDACTED_ADDRESS]', line)
+    # 3. Non-Transaction Line: Aggressive Scrubbing (GLOBALLY, no line
+    # limit). PINs, phones, and Name/Address headers are redacted in a
+    # single combined pass.
+    line = NON_TX_SCRUB_PATTERN.sub(_non_tx_replacer, line)
 
+    # --- Address Keywords ---
+    upper_line = line.upper()
+    if ADDR_KEYWORD_PATTERN.search(upper_line):
+        return "[REDACTED_ADDRESS_LINE]"
 
-        # --- Address Keywords ---
-        upper_line = line.upper()
-        is_address_line = bool(scrub_sensitive_data.addr_keyword_pattern.search(upper_line))
-        if is_address_line:
-            line = "[REDACTED_ADDRESS_LINE]"
-            cleaned_lines.append(line)
-            continue
+    # --- Name-like Line Heuristic (Globally) ---
+    upper_words = [w for w in line.split() if w.isupper() and w.isalpha()]
+    total_words = [w for w in line.split() if w.strip()]
 
-        # --- Name-like Line Heuristic (Globally) ---
-        upper_words = [w for w in line.split() if w.isupper() and w.isalpha()]
-        total_words = [w for w in line.split() if w.strip()]
+    is_safe_header = any(safe in upper_line for safe in SAFE_HEADERS)
 
-        safe_headers = ['STATEMENT', 'SUMMARY', 'PAYMENT', 'DATE', 'DETAILS', 'MERCHANT', 'CATEGORY', 'AMOUNT', 'CREDIT', 'DEBIT', 'BALANCE', 'TOTAL', 'DUE', 'TRANSACTIONS', 'DOMESTIC', 'BASE', 'NEUCOINS', 'LIMIT', 'ACCOUNT', 'OPENING', 'PURCHASE', 'FINANCE', 'CHARGES', 'MINIMUM', 'OVERLIMIT', 'BANK', 'CARD', 'GSTIN', 'HSN', 'CODE', 'PAGE', 'EMAIL', 'INFO']
-        is_safe_header = any(safe in upper_line for safe in safe_headers)
+    if not is_safe_header:
+        len_upper = len(upper_words)
+        len_total = len(total_words)
+        # If 80% of words are uppercase and there are at least 2, it's a name candidate
+        if len_total > 0 and len_upper >= 2 and len_upper >= (len_total * 0.8):
+            return "[REDACTED_NAME_CANDIDATE]"
 
-        if not is_safe_header:
-            len_upper = len(upper_words)
-            len_total = len(total_words)
-            # If 80% of words are uppercase and there are at least 2, it's a name candidate
-            if len_total > 0 and len_upper >= 2 and len_upper >= (len_total * 0.8):
-                line = "[REDACTED_NAME_CANDIDATE]"
+    return line
 
-        cleaned_lines.append(line)
 
-    return '\n'.join(cleaned_lines)
+# Fields that may carry account numbers and need masking
+MASKABLE_FIELDS = ('merchant', 'notes', 'description', 'memo')
 
+# Separator for the batched masking pass: never appears in statement
+# text and is not matched by the card patterns, so values can't bleed
+# into each other.
+_MASK_SENTINEL = '\x1f'
 
 
 def mask_transaction_pii(transactions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
     Apply PII masking to a list of transaction dictionaries.
     Masks account numbers in merchant names and any other string fields.
-    """
-    masked_transactions = []
 
+    All unique field values are joined with a sentinel and masked in one
+    regex pass instead of one sub call per field per transaction;
+    recurring merchants are deduplicated by the same table.
+    """
+    unique_values: Dict[str, str] = {}
     for tx in transactions:
-        masked_tx = tx.copy()
+        for field in MASKABLE_FIELDS:
+            value = tx.get(field)
+            if isinstance(value, str):
+                unique_values[value] = value
 
-        # Mask merchant name
-        if 'merchant' in masked_tx and isinstance(masked_tx['merchant'], str):
-            masked_tx['merchant'] = mask_account_numbers(masked_tx['merchant'])
+    if unique_values:
+        if any(_MASK_SENTINEL in value for value in unique_values):
+            # A value contains the sentinel itself; mask individually.
+            for value in unique_values:
+                unique_values[value] = mask_account_numbers(value)
+        else:
+            masked_joined = mask_account_numbers(_MASK_SENTINEL.join(unique_values))
+            for value, masked in zip(unique_values, masked_joined.split(_MASK_SENTINEL)):
+                unique_values[value] = masked
 
-        # Mask any notes or description fields if present
-        for field in ['notes', 'description', 'memo']:
-            if field in masked_tx and isinstance(masked_tx[field], str):
-                masked_tx[field] = mask_account_numbers(masked_tx[field])
+    return [_mask_one(tx, unique_values) for tx in transactions]
 
-        masked_transactions.append(masked_tx)
 
-    return masked_transactions
+def _mask_one(tx: Dict[str, Any], masked_values: Dict[str, str]) -> Dict[str, Any]:
+    """Return tx with masked fields substituted, or tx itself unchanged.
+
+    Only copies the dict when a field actually changed; the common case
+    (no card numbers anywhere) reuses the original.
+    """
+    changes = None
+    for field in MASKABLE_FIELDS:
+        value = tx.get(field)
+        if isinstance(value, str):
+            masked = masked_values[value]
+            if masked != value:
+                if changes is None:
+                    changes = {}
+                changes[field] = masked
+    return {**tx, **changes} if changes else tx
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# Add parent directory to path so we can import main
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from main import app  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    # One app instance (and startup/shutdown cycle) for the whole run
+    # instead of a fresh TestClient per test module.
+    with TestClient(app) as test_client:
+        yield test_client
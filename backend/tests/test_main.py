@@ -1,14 +1,4 @@
-from fastapi.testclient import TestClient
-from main import app
-import sys
-import os
-
-# Add parent directory to path so we can import main
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
-client = TestClient(app)
-
-def test_read_health():
+def test_read_health(client):
     response = client.get("/health")
     assert response.status_code == 200
     assert response.json()["status"] == "healthy"
@@ -20,6 +20,18 @@ def test_preserve_dates():
     scrubbed = scrub_sensitive_data(text)
     assert "2024-01-30" in scrubbed
 
+def test_preserve_adjacent_date_columns():
+    # Two hyphenated dates side by side form a 13+ digit run; the date
+    # prefix must keep the row intact for transaction extraction
+    text = "15-01-2024 16-01-2024 AMAZON RETAIL 1,234.00"
+    scrubbed = scrub_sensitive_data(text)
+    assert scrubbed == text
+
+def test_preserve_date_with_reference_number():
+    text = "15-01-2024 123456789 UBER 450.00"
+    scrubbed = scrub_sensitive_data(text)
+    assert scrubbed == text
+
 def test_short_numbers_preserved():
     text = "Amount: 1234.56"
     scrubbed = scrub_sensitive_data(text)